@@ -9,8 +9,8 @@ Created on Mon Nov 20 13:00:15 2017
 import numpy as np
 import pandas as pd
 import json
-from random import choice, shuffle
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 from time import time
 
 import gzip
@@ -19,94 +19,181 @@ import os
 
 # special data types
 from collections import deque
-from queue import Queue
-from randomdict import RandomDict
 
-from geometry import City
+from geometry import City, njit, prange, _manhattan
 
+try:
+    # faster serialization of the per request metrics, if orjson is installed
+    import orjson
+except ImportError:
+    orjson = None
 
-class Taxi:
+# columns of Simulation.taxi_times
+TIME_SERVING, TIME_WAITING, TIME_TO_REQUEST, TIME_CRUISING = range(4)
+
+
+@njit(cache=True)
+def _greedy_match(taxi_x, taxi_y, taxi_rank, req_ox, req_oy, hard_limit):
     """
-   Represents a taxi in the simulation.
+    Greedily assign the nearest free taxi to each request, in the order of the requests.
 
-   Attributes
-   ----------
+    Among taxis at the same distance, the one with the lowest rank is chosen.
 
-   x : int
-       horizontal grid coordinate
+    Parameters
+    ----------
 
-   y : int
-       vertical grid coordinate
+    taxi_x, taxi_y : np.array of ints
+        grid coordinates of the available taxis
 
-   taxi_id : int
-       unique identifier of taxi
+    taxi_rank : np.array of ints
+        random permutation of the available taxis that breaks distance ties
 
-   available : bool
-       flag that stores whether taxi is free
+    req_ox, req_oy : np.array of ints
+        grid coordinates of the request origins
 
-   to_request : bool
-       flag that stores when taxi is moving towards a request
-       but there is still no user sitting in it
+    hard_limit : int
+        taxis have to be closer than this distance to the request origin
 
-   with_passenger : bool
-       flag that stores when taxi is carrying a passenger
+    Returns
+    -------
 
-   actual_request_executing : int
-       id of request that is being executed by the taxi
+    matched : np.array of ints
+        index of the taxi assigned to each request, -1 if there was no free taxi within the limit
+    """
+    matched = np.full(len(req_ox), -1, dtype=np.int32)
+    taken = np.zeros(len(taxi_x), dtype=np.bool_)
+    num_free = len(taxi_x)
+
+    for i in range(len(req_ox)):
+        if num_free == 0:
+            break
+        best = hard_limit
+        for t in range(len(taxi_x)):
+            if taken[t]:
+                continue
+            d = _manhattan(taxi_x[t], taxi_y[t], req_ox[i], req_oy[i])
+            if d < best or (d == best and matched[i] >= 0 and taxi_rank[t] < taxi_rank[matched[i]]):
+                best = d
+                matched[i] = t
+        if matched[i] >= 0:
+            taken[matched[i]] = True
+            num_free -= 1
+
+    return matched
+
+
+@njit(parallel=True, cache=True)
+def _advance_taxis(taxi_x, taxi_y, paths, path_head, path_tail):
+    """
+    Move every taxi one step forward on its path, in place.
 
-   requests_completed : list of ints
-       list of requests completed by taxi
+    Parameters
+    ----------
 
-   time_waiting : int
-       time spent with empty waiting
+    taxi_x, taxi_y : np.array of ints
+        grid coordinates of the taxis
 
-   time_serving : int
-       time spent with carrying a passenger
+    paths : np.array of ints
+        path buffers of the taxis, the steps still to take by taxi i are paths[i, path_head[i]:path_tail[i]]
 
-   time_to_request : int
-       time spent from call assignment to pickup, without a passenger
+    path_head, path_tail : np.array of ints
+        index of the next step and index after the last step in the path buffers
 
-   time_cruising : int
-       time spent with travelling empty with no assigned requests
+    Returns
+    -------
 
-   next_destination : Queue
-       Queue that stores the path forward of the taxi
+    moved : np.array of bools
+        whether each taxi has taken a step, taxis with an empty path stay in place
+    """
+    moved = np.zeros(len(path_head), dtype=np.bool_)
 
-   home : tuple
-        if config setting is "initial_conditions":"random", then this will be the home of the taxi instead of the base
+    for i in prange(len(path_head)):
+        if path_head[i] < path_tail[i]:
+            taxi_x[i] = paths[i, path_head[i], 0]
+            taxi_y[i] = paths[i, path_head[i], 1]
+            path_head[i] += 1
+            moved[i] = True
 
-   """
+    return moved
 
-    def __init__(self, coords=None, taxi_id=None):
-        if coords is None:
-            print("You have to put your taxi somewhere in the city!")
-        elif taxi_id is None:
-            print("Not a licenced taxi.")
-        else:
 
-            self.x = coords[0]
-            self.y = coords[1]
+class Taxi:
+    """
+    Represents a taxi in the simulation.
+
+    The state of the taxi is stored in the arrays of a Simulation and its City,
+    this class is a read-only view of that state.
+
+    Attributes
+    ----------
+
+    x : int
+        horizontal grid coordinate
+
+    y : int
+        vertical grid coordinate
+
+    taxi_id : int
+        unique identifier of taxi
+
+    available : bool
+        flag that stores whether taxi is free
+
+    to_request : bool
+        flag that stores when taxi is moving towards a request
+        but there is still no user sitting in it
 
-            self.taxi_id = taxi_id
+    with_passenger : bool
+        flag that stores when taxi is carrying a passenger
 
-            self.available = True
-            self.to_request = False
-            self.with_passenger = False
+    actual_request_executing : int
+        id of request that is being executed by the taxi
 
-            self.actual_request_executing = None
-            self.requests_completed = set()
+    requests_completed : set of ints
+        requests completed by taxi
 
-            # types of time metrics to be stored
-            self.time_waiting = 0
-            self.time_serving = 0
-            self.time_cruising = 0
-            self.time_to_request = 0
+    home : tuple
+        if config setting is "initial_conditions":"home", then this will be the home of the taxi instead of the base
+    """
+
+    def __init__(self, simulation, taxi_id):
+        self.simulation = simulation
+        self.taxi_id = taxi_id
+
+    @property
+    def x(self):
+        return int(self.simulation.city.taxi_x[self.taxi_id])
+
+    @property
+    def y(self):
+        return int(self.simulation.city.taxi_y[self.taxi_id])
+
+    @property
+    def available(self):
+        return bool(self.simulation.city.taxi_available[self.taxi_id])
 
-            # storing steps to take
-            self.next_destination = deque()  # path to travel
+    @property
+    def to_request(self):
+        return self.taxi_id in self.simulation.taxis_to_request
 
-            # this can only be filled if the city geometry is known
-            self.home = None
+    @property
+    def with_passenger(self):
+        return self.taxi_id in self.simulation.taxis_to_destination
+
+    @property
+    def actual_request_executing(self):
+        request_id = int(self.simulation.taxi_request[self.taxi_id])
+        return request_id if request_id >= 0 else None
+
+    @property
+    def requests_completed(self):
+        requests = self.simulation.requests
+        completed = (requests.taxi_id[:len(requests)] == self.taxi_id) & (requests.mode[:len(requests)] == 'done')
+        return set(np.flatnonzero(completed).tolist())
+
+    @property
+    def home(self):
+        return tuple(self.simulation.taxi_home[self.taxi_id].tolist())
 
     def __str__(self):
         """
@@ -136,13 +223,17 @@ class Taxi:
         """
         This method converts the class into a dict, with attributes as keys.
         """
-        for attr, value in self.__dict__.items():
-            yield attr, value
+        for attr in ['taxi_id', 'x', 'y', 'available', 'to_request', 'with_passenger',
+                     'actual_request_executing', 'requests_completed', 'home']:
+            yield attr, getattr(self, attr)
 
 
 class Request:
     """
     Represents a request that is being made.
+
+    The data of the request is stored in a row of a RequestTable,
+    this class is a read-only view of that row.
     
     Attributes
     ----------
@@ -166,39 +257,38 @@ class Request:
         stores simulation timestamps of the change of mode
     """
 
-    def __init__(self, ocoords=None, dcoords=None, request_id=None, timestamp=None):
-        """
-        
-        """
-        if (ocoords is None) or (dcoords is None):
-            print("A request has to have a well-defined origin and destination.")
-        elif request_id is None:
-            print("Please identify each request uniquely.")
-        elif timestamp is None:
-            print("Please give a timestamp for the request!")
-        else:
-            # pickup coordinates
-            self.ox = ocoords[0]
-            self.oy = ocoords[1]
+    def __init__(self, table, request_id):
+        self.table = table
+        self.request_id = request_id
 
-            # desired dropoff coordinates
-            self.dx = dcoords[0]
-            self.dy = dcoords[1]
+    @property
+    def ox(self):
+        return int(self.table.ox[self.request_id])
 
-            # id
-            self.request_id = request_id
+    @property
+    def oy(self):
+        return int(self.table.oy[self.request_id])
 
-            # travel info, different time metrics
-            self.taxi_id = None
+    @property
+    def dx(self):
+        return int(self.table.dx[self.request_id])
 
-            self.timestamps = {
-                'request': timestamp,
-                'assigned': None,
-                'pickup': None,
-                'dropoff': None
-            }
+    @property
+    def dy(self):
+        return int(self.table.dy[self.request_id])
 
-            self.mode = 'pending'
+    @property
+    def taxi_id(self):
+        taxi_id = int(self.table.taxi_id[self.request_id])
+        return taxi_id if taxi_id >= 0 else None
+
+    @property
+    def mode(self):
+        return str(self.table.mode[self.request_id])
+
+    @property
+    def timestamps(self):
+        return {k: self.table.timestamp(k, self.request_id) for k in self.table.timestamp_keys}
 
     def __str__(self):
         """
@@ -209,6 +299,7 @@ class Request:
         string
 
         """
+        timestamps = self.timestamps
         s = [
             "Request ",
             str(self.request_id),
@@ -217,17 +308,17 @@ class Request:
             "\tDestination ",
             str(self.dx) + "," + str(self.dy) + "\n",
             "\tRequest timestamp ",
-            str(self.timestamps['request']) + "\n"
+            str(timestamps['request']) + "\n"
         ]
         if self.taxi_id is not None:
             s += ["\tTaxi assigned ", str(self.taxi_id), ".\n"]
-            s += ["\tWaiting since ", str(self.timestamp['request']), ".\n"]
-            if self.mode != 'pending':
-                s += ["\tPickup timestamp ", str(self.timestamps['pickup']), ".\n"]
-                if self.timestamps['dropoff'] is not None:
-                    s += ["\tDropoff timestamp ", str(self.timestamps['dropoff']), ".\n"]
+            s += ["\tAssignment timestamp ", str(timestamps['assigned']), ".\n"]
+            if self.mode != 'waiting':
+                s += ["\tPickup timestamp ", str(timestamps['pickup']), ".\n"]
+                if timestamps['dropoff'] is not None:
+                    s += ["\tDropoff timestamp ", str(timestamps['dropoff']), ".\n"]
         else:
-            s += ["\tPending since ", str(self.time - self.timestamps['request']), ".\n"]
+            s += ["\tPending since ", str(timestamps['request']), ".\n"]
 
         return "".join(s)
 
@@ -235,8 +326,113 @@ class Request:
         """
         This method converts the class into a dict, with attributes as keys.
         """
-        for attr, value in self.__dict__.iteritems():
-            yield attr, value
+        for attr in ['request_id', 'ox', 'oy', 'dx', 'dy', 'taxi_id', 'mode', 'timestamps']:
+            yield attr, getattr(self, attr)
+
+
+class RequestTable:
+    """
+    Stores all requests in parallel arrays, indexed by request_id.
+
+    Storage is doubled when it is full.
+
+    Attributes
+    ----------
+
+    ox,oy : np.array of ints
+        grid coordinates of request origins
+
+    dx,dy : np.array of ints
+        grid coordinates of request destinations
+
+    taxi_id : np.array of ints
+        id of taxi that serves the request, -1 if there is none
+
+    mode : np.array of str
+        current mode of the requests
+
+    request_ts, assigned_ts, pickup_ts, dropoff_ts : np.array of ints
+        simulation timestamps of the change of mode, -1 if it has not happened yet
+    """
+
+    timestamp_keys = ['request', 'assigned', 'pickup', 'dropoff']
+
+    def __init__(self, capacity=1024):
+        self.num_requests = 0
+
+        self.ox = np.zeros(capacity, dtype=np.int32)
+        self.oy = np.zeros(capacity, dtype=np.int32)
+        self.dx = np.zeros(capacity, dtype=np.int32)
+        self.dy = np.zeros(capacity, dtype=np.int32)
+
+        self.taxi_id = np.full(capacity, -1, dtype=np.int32)
+        self.mode = np.full(capacity, 'pending', dtype='<U7')
+
+        self.request_ts = np.full(capacity, -1, dtype=np.int64)
+        self.assigned_ts = np.full(capacity, -1, dtype=np.int64)
+        self.pickup_ts = np.full(capacity, -1, dtype=np.int64)
+        self.dropoff_ts = np.full(capacity, -1, dtype=np.int64)
+
+    def add_many(self, coords, timestamp):
+        """
+        Store several new pending requests with the same timestamp.
+
+        Parameters
+        ----------
+
+        coords : np.array of ints
+            one row of ox, oy, dx, dy per request
+
+        timestamp : int
+
+        Returns
+        -------
+
+        request_ids : range
+        """
+        start = self.num_requests
+        stop = start + len(coords)
+        while stop > len(self.ox):
+            self.grow()
+
+        self.ox[start:stop] = coords[:, 0]
+        self.oy[start:stop] = coords[:, 1]
+        self.dx[start:stop] = coords[:, 2]
+        self.dy[start:stop] = coords[:, 3]
+        self.request_ts[start:stop] = timestamp
+        self.num_requests = stop
+
+        return range(start, stop)
+
+    def grow(self):
+        """
+        Double the storage, filling the new rows with default values.
+        """
+        capacity = len(self.ox)
+        for attr, fill in [('ox', 0), ('oy', 0), ('dx', 0), ('dy', 0), ('taxi_id', -1), ('mode', 'pending'),
+                           ('request_ts', -1), ('assigned_ts', -1), ('pickup_ts', -1), ('dropoff_ts', -1)]:
+            old = getattr(self, attr)
+            new = np.full(2 * capacity, fill, dtype=old.dtype)
+            new[:capacity] = old
+            setattr(self, attr, new)
+
+    def timestamp(self, key, request_id):
+        """
+        Timestamp of a request, None if it has not happened yet.
+        """
+        ts = int(getattr(self, key + '_ts')[request_id])
+        return ts if ts >= 0 else None
+
+    def __getitem__(self, request_id):
+        if not 0 <= request_id < self.num_requests:
+            raise KeyError(request_id)
+        return Request(self, request_id)
+
+    def __iter__(self):
+        return iter(range(self.num_requests))
+
+    def __len__(self):
+        return self.num_requests
 
 
 class Simulation:
@@ -257,40 +453,59 @@ class Simulation:
     hard_limit : int
         max distance from which a taxi is still assigned to a request
     
-    taxis : dict
-        storing all Taxi() instances in a dict
-        keys are `taxi_id`s
+    taxis : list
+        storing Taxi() views of the taxis in a list
+        indexed by `taxi_id`s
     
     latest_taxi_id : int
         shows latest given taxi_id
         used or generating new taxis
     
-    taxis_available : list of int
+    taxis_available : set of int
         stores `taxi_id`s of available taxis
+
+    paths : np.array of ints
+        preallocated buffers that store the path forward of each taxi,
+        the steps still to take by taxi i are paths[i, path_head[i]:path_tail[i]]
+
+    path_head, path_tail : np.array of ints
+        index of the next step and index after the last step in the path buffers
+
+    taxi_times : np.array of ints
+        time spent by each taxi serving, waiting, travelling to a request and cruising,
+        one row per taxi, columns are indexed by TIME_SERVING, TIME_WAITING, TIME_TO_REQUEST, TIME_CRUISING
+
+    taxi_request : np.array of ints
+        id of the request that is being executed by each taxi, -1 if there is none
+
+    taxi_home : np.array of ints
+        home coordinates of each taxi, one row per taxi
+
+    taxi_income : np.array of ints or floats
+        earnings of each taxi so far, indexed by `taxi_id`,
+        integers if all prices and costs are integers
+        updated whenever they change, see `eval_taxi_income`
     
-    taxis_to_request : list of int
+    taxis_to_request : set of int
         stores `taxi_id`s of taxis moving to serve a request
     
-    taxis_to_destination : list of int
+    taxis_to_destination : set of int
         stores `taxi_id`s of taxis with passenger
     
-    requests : dict
-        storing all Request() instances in a dict
-        keys are `request_id`s
+    requests : RequestTable
+        storing the data of all requests in arrays
+        indexed by `request_id`s, rows can be viewed as Request() instances
     
     latest_request_id : int
         shows latest given request_id
         used or generating new requests
     
-    requests_pending : list of int
-        requests waiting to be served
+    requests_pending_deque : deque of int
+        requests waiting to be served, in the order of their timestamps
     
-    requests_in_progress : list of int
+    requests_in_progress : set of int
         requests with assigned taxis
     
-    requests_dropped : list of int
-        unsuccessful requests
-    
     city : City
         geometry of class City() underlying the simulation
         
@@ -370,23 +585,37 @@ class Simulation:
         self.latest_request_id = 0
 
         # initializing object storage
-        self.taxis = RandomDict()
-        self.taxis_available = RandomDict()
+        self.taxis = []
+        self.taxis_available = set()
         self.taxis_to_request = set()
         self.taxis_to_destination = set()
+        self.taxi_times = np.zeros((self.num_taxis, 4), dtype=np.int64)
+        self.taxi_request = np.full(self.num_taxis, -1, dtype=np.int64)
+        self.taxi_home = np.zeros((self.num_taxis, 2), dtype=np.int32)
+        # integer prices and costs keep the incomes integers
+        prices = [self.price_fixed, self.price_per_dist, self.cost_per_unit, self.cost_per_time]
+        if all(isinstance(p, (int, np.integer)) for p in prices):
+            self.taxi_income = np.zeros(self.num_taxis, dtype=np.int64)
+        else:
+            self.taxi_income = np.zeros(self.num_taxis)
 
-        self.requests = RandomDict()
-        self.requests_pending = set()
+        self.requests = RequestTable()
 
         # speeding up going through requests in the order of waiting times
         # they are pushed into a deque in the order of timestamps
         self.requests_pending_deque = deque()
-        self.requests_pending_deque_batch = deque(maxlen=self.max_request_waiting_time)
         self.requests_pending_deque_temporary = deque()
         self.requests_in_progress = set()
 
         # city layout
         self.city = City(**config)
+        # the simulation draws from the random number generator of the city
+        self._rng = self.city._rng
+        # a path to a request and then to its destination is at most two grid diameters long
+        self.max_path_length = 2 * (self.city.n + self.city.m)
+        self.paths = np.zeros((self.num_taxis, self.max_path_length, 2), dtype=np.int32)
+        self.path_head = np.zeros(self.num_taxis, dtype=np.int32)
+        self.path_tail = np.zeros(self.num_taxis, dtype=np.int32)
         # length of pregenerated random number storage
         self.city.length = int(min(self.max_time*self.request_rate, 1e6))
 
@@ -400,7 +629,7 @@ class Simulation:
         for t in range(self.num_taxis):
             self.add_taxi()
 
-        self.taxi_df = pd.DataFrame.from_dict([dict(v) for k, v in self.taxis.items()])
+        self.taxi_df = pd.DataFrame.from_dict([dict(v) for v in self.taxis])
         self.taxi_df.set_index('taxi_id', inplace=True)
 
         if self.show_plot:
@@ -410,10 +639,13 @@ class Simulation:
             self.canvas_ax.set_aspect('equal', 'box')
             self.cmap = plt.get_cmap('viridis')
             self.taxi_colors = list(np.linspace(0, 0.85, self.num_taxis))
-            shuffle(self.taxi_colors)
+            self._rng.shuffle(self.taxi_colors)
+            # RGBA values of the taxi colors, looked up once
+            self._rgba = self.cmap(self.taxi_colors)
             self.show_map_labels = config["show_map_labels"]
             self.show_pending = config["show_pending"]
             self.init_canvas()
+            self.init_artists()
 
     def init_canvas(self):
         """
@@ -443,92 +675,78 @@ class Simulation:
 
         # adding home coordinates, starting taxi
         home = self.city.create_taxi_home_coords()
+        self.taxi_home[self.latest_taxi_id] = home
 
         if self.initial_conditions == "base":
             # create a taxi at the base
-            tx = Taxi(self.city.base_coords, self.latest_taxi_id)
+            coords = self.city.base_coords
         elif self.initial_conditions == "home":
             # create a taxi at home
-            tx = Taxi(home, self.latest_taxi_id)
-        tx.home = home
+            coords = home
 
-        # add to taxi storage
-        self.taxis[self.latest_taxi_id] = tx
-        # add to available taxi matrix
-        self.city.A[self.city.coordinate_dict_ij_to_c[tx.x][tx.y]].add(self.latest_taxi_id)
+        # add to taxi storage, taxi_id is the index in the list
+        self.taxis.append(Taxi(self, self.latest_taxi_id))
+        # add to available taxi arrays
+        self.city.add_taxi(self.latest_taxi_id, coords)
         # add to available taxi storage
-        self.taxis_available[self.latest_taxi_id] = tx
+        self.taxis_available.add(self.latest_taxi_id)
         # increase counter
         self.latest_taxi_id += 1
 
-    def add_request(self):
+    def add_request(self, count=1):
         """
-        Create new request.
-        
+        Create new requests.
+
+        Parameters
+        ----------
+
+        count : int, default 1
+            number of requests to create
         """
         # here we randomly choose a place for the request
         # the random coordinates are pre-stored in a deque for faster access
         # if there are no more pregenerated coordinates in the deque, we generate some more
 
         # origin and destination coordinates
-        ox, oy, dx, dy = self.city.create_one_request_coord()
-        r = Request([ox, oy], [dx, dy], self.latest_request_id, self.time)
+        coords = self.city.create_request_coords(count)
 
         # add to request storage
-        self.requests[self.latest_request_id] = r
+        request_ids = self.requests.add_many(coords, self.time)
         # add to free users
-        self.requests_pending_deque.append(self.latest_request_id)
+        self.requests_pending_deque.extend(request_ids)
         # increase counter
-        self.latest_request_id += 1
+        self.latest_request_id += count
 
     def go_to_base(self, taxi_id, bcoords):
         """
         This function sends the taxi to the base rom wherever it is.
         """
 
-        # fetch object
-        t = self.taxis[taxi_id]
-
         # actual coordinates
-        acoords = [t.x, t.y]
+        acoords = [self.city.taxi_x[taxi_id], self.city.taxi_y[taxi_id]]
         # path between actual coordinates and destination
-        path = self.city.create_path(acoords, bcoords)
-
-        # erase path memory
-        t.with_passenger = False
-        t.to_request = False
-        t.available = True
-        #        print("Erasing path memory, Taxi "+str(taxi_id)+".")
-        t.next_destination = deque()
-        # put path into taxi path queue
-        #        print("Filling path memory, Taxi "+str(taxi_id)+". Path ",path)
-        t.next_destination.extend(path)
+        # overwrites the path memory of the taxi
+        path = self.city.create_path(acoords, bcoords, out=self.paths[taxi_id])
 
-        # put object back to its place
-        self.taxis[taxi_id] = t
+        self.path_head[taxi_id] = 0
+        self.path_tail[taxi_id] = len(path)
 
     def go_home_everybody(self):
         """
         Drop requests that are currently executing, and set taxis as available at their home locations.
         """
-        for taxi_id in self.taxis:
-            tx = self.taxis[taxi_id]
+        # (magic wand) Apparate available taxis home!
+        available = self.city.taxi_available[:self.num_taxis]
+        self.city.taxi_x[:self.num_taxis][available] = self.taxi_home[available, 0]
+        self.city.taxi_y[:self.num_taxis][available] = self.taxi_home[available, 1]
 
-            if taxi_id in self.taxis_available:
-                # (magic wand) Apparate taxi home!
-                self.city.A[self.city.coordinate_dict_ij_to_c[tx.x][tx.y]].remove(taxi_id)
-                self.city.A[self.city.coordinate_dict_ij_to_c[tx.home[0]][tx.home[1]]].add(taxi_id)
-                tx.x, tx.y = tx.home
+        for taxi_id in sorted(self.taxis_to_destination):
+            # if somebody is sitting in it, finish request
+            self.dropoff_request(int(self.taxi_request[taxi_id]), mode="going_home")
 
-            if taxi_id in self.taxis_to_destination:
-                # if somebody is sitting in it, finish request
-                self.dropoff_request(tx.actual_request_executing, mode="going_home")
-
-            if taxi_id in self.taxis_to_request:
-                # if it was only going towards a request, cancel it
-                self.dropoff_request(tx.actual_request_executing, mode="cancel")
-
-            self.taxis[taxi_id] = tx
+        for taxi_id in sorted(self.taxis_to_request):
+            # if it was only going towards a request, cancel it
+            self.dropoff_request(int(self.taxi_request[taxi_id]), mode="cancel")
 
     def cruise(self, taxi_id):
         return None
@@ -539,39 +757,41 @@ class Simulation:
         It sets new state variables for the request and the taxi, updates path of the taxi etc.
         """
         r = self.requests[request_id]
-        t = self.taxis[taxi_id]
 
         # pair the match
-        t.actual_request_executing = request_id
-        r.taxi_id = taxi_id
+        self.taxi_request[taxi_id] = request_id
+        self.requests.taxi_id[request_id] = taxi_id
 
         # remove taxi from the available ones
-        self.city.A[self.city.coordinate_dict_ij_to_c[t.x][t.y]].remove(taxi_id)
-        del self.taxis_available[taxi_id]
-        t.with_passenger = False
-        t.available = False
-        t.to_request = True
+        self.city.taxi_available[taxi_id] = False
+        self.taxis_available.remove(taxi_id)
 
         # mark taxi as moving to request
         self.taxis_to_request.add(taxi_id)
-
-        # forget the path that has been assigned
-        t.next_destination = deque()
+        # the fixed price is earned from the assignment on
+        self.taxi_income[taxi_id] += self.price_fixed
 
         # create new path: to user, then to destination
-        path = self.city.create_path([t.x, t.y], [r.ox, r.oy]) + \
-            self.city.create_path([r.ox, r.oy], [r.dx, r.dy])[1:]
-        t.next_destination.extend(path)
+        # written straight into the path memory of the taxi, overwriting its previous path
+        # the second leg starts at the last row of the first one, which is the request origin for both
+        path_to_request = self.city.create_path(
+            [self.city.taxi_x[taxi_id], self.city.taxi_y[taxi_id]],
+            [r.ox, r.oy],
+            out=self.paths[taxi_id]
+        )
+        path_to_destination = self.city.create_path(
+            [r.ox, r.oy],
+            [r.dx, r.dy],
+            out=self.paths[taxi_id, len(path_to_request) - 1:]
+        )
+
+        self.path_head[taxi_id] = 0
+        self.path_tail[taxi_id] = len(path_to_request) + len(path_to_destination) - 1
 
         # remove request from the pending ones, label it as "in progress"
         self.requests_in_progress.add(request_id)
-        r.mode = 'waiting'
-        r.timestamps['assigned'] = self.time
-
-        # update taxi state in taxi storage
-        self.taxis[taxi_id] = t
-        # update request state
-        self.requests[request_id] = r
+        self.requests.mode[request_id] = 'waiting'
+        self.requests.assigned_ts[request_id] = self.time
 
         if self.log:
             print("\tM request " + str(request_id) + " taxi " + str(taxi_id))
@@ -596,91 +816,109 @@ class Simulation:
                 print("No pending requests.")
             return
 
+        if len(self.taxis_available) == 0:
+            if self.log:
+                print("No available taxis.")
+            return
+
         if self.log:
             print('Matching algorithm.')
 
+        # local names for the containers used in the loops below
+        city = self.city
+        requests = self.requests
+        pending = self.requests_pending_deque
+        still_pending = self.requests_pending_deque_temporary
+
         if mode == "random_unlimited":
+            # available taxis in random order
+            ta_list = self._rng.permutation(np.flatnonzero(city.taxi_available)).tolist()
 
-            while len(self.requests_pending_deque) > 0 and len(self.taxis_available) > 0:
-                # select a random taxi
-                taxi_id = self.taxis_available.random_key()
+            for taxi_id in ta_list:
+                if len(pending) == 0:
+                    break
                 # select oldest request from deque
-                request_id = self.requests_pending_deque.popleft()
+                request_id = pending.popleft()
                 # make assignment
                 self.assign_request(request_id, taxi_id)
 
         elif mode == "random_limited":
-            while len(self.requests_pending_deque) > 0 and len(self.taxis_available) > 0:
+            # taxis stand still during matching, one index serves all lookups
+            index = city.index_available_taxis()
+
+            while len(pending) > 0 and len(self.taxis_available) > 0:
                 # select oldest request from deque
-                request_id = self.requests_pending_deque.popleft()
-                # fetch request
-                r = self.requests[request_id]
+                request_id = pending.popleft()
                 # search for nearest free taxis
-                possible_taxi_ids = self.city.find_nearest_available_taxis(
-                    self.city.coordinate_dict_ij_to_c[r.ox][r.oy],
+                possible_taxi_ids = city.find_nearest_available_taxis(
+                    [requests.ox[request_id], requests.oy[request_id]],
                     mode="circle",
-                    radius=self.city.hard_limit
+                    radius=city.hard_limit,
+                    index=index
                 )
                 # if there were any taxis near
                 if len(possible_taxi_ids) > 0:
                     # select taxi
-                    taxi_id = choice(possible_taxi_ids)
+                    taxi_id = possible_taxi_ids[self._rng.integers(len(possible_taxi_ids))]
                     self.assign_request(request_id, taxi_id)
                 else:
                     # mark request as still pending
-                    self.requests_pending_deque_temporary.append(request_id)
+                    still_pending.append(request_id)
 
         elif mode == "nearest":
-            while len(self.requests_pending_deque) > 0 and len(self.taxis_available) > 0:
-                # select oldest request from deque
-                request_id = self.requests_pending_deque.popleft()
-                # fetch request
-                r = self.requests[request_id]
-                # search for nearest free taxis
-                possible_taxi_ids = self.city.find_nearest_available_taxis(
-                    self.city.coordinate_dict_ij_to_c[r.ox][r.oy])
+            # all pending requests are matched at once, in the order of their waiting times
+            rp_list = np.fromiter(pending, dtype=np.int64, count=len(pending))
+            pending.clear()
+
+            ta_list = np.flatnonzero(city.taxi_available)
+            req_ox = requests.ox[rp_list]
+            req_oy = requests.oy[rp_list]
+
+            matched = _greedy_match(
+                city.taxi_x[ta_list],
+                city.taxi_y[ta_list],
+                self._rng.permutation(len(ta_list)),
+                req_ox,
+                req_oy,
+                city.hard_limit
+            )
+
+            for request_id, k in zip(rp_list.tolist(), matched.tolist()):
                 # if there were any taxis near
-                if len(possible_taxi_ids) > 0:
-                    # select taxi
-                    taxi_id = choice(possible_taxi_ids)
-                    self.assign_request(request_id, taxi_id)
+                if k >= 0:
+                    self.assign_request(request_id, int(ta_list[k]))
                 else:
                     # mark request as still pending
-                    self.requests_pending_deque_temporary.append(request_id)
+                    still_pending.append(request_id)
 
         elif mode == "poorest":
             # always order taxi that has earned the least money so far
             # but choose only from the nearest ones
             # hard limiting: e.g. if there is no taxi within the radius, then quit
 
-            # evaulate the earnings of the available taxis so far
-            ta_list = list(self.taxis_available.keys)
-            # print('Available taxis ', self.taxis_available.keys)
-            taxi_earnings = [self.eval_taxi_income(taxi_id) for taxi_id in ta_list]
-            # print('Earnings ', taxi_earnings)
-            ta_list = list(np.array(ta_list)[np.argsort(taxi_earnings)])
+            # order the available taxis by their earnings so far
+            ta_list = np.flatnonzero(city.taxi_available)
+            ta_list = ta_list[np.argsort(self.eval_taxi_income(ta_list), kind="stable")].tolist()
+            # taxis stand still during matching, one index serves all lookups
+            index = city.index_available_taxis()
 
-            pairs = 0
-            while len(self.requests_pending_deque) > 0 and len(self.taxis_available) > 0:
+            while len(pending) > 0 and len(self.taxis_available) > 0:
                 # select oldest request from deque
-                request_id = self.requests_pending_deque.popleft()
-                # fetch request
-                r = self.requests[request_id]
+                request_id = pending.popleft()
                 # find nearest vehicles in a radius
-                possible_taxi_ids = self.city.find_nearest_available_taxis(self.city.coordinate_dict_ij_to_c[r.ox][r.oy],
-                                                                      mode="circle",
-                                                                      radius=self.city.hard_limit)
-                hit = 0
-                for t in ta_list:
-                    if t in possible_taxi_ids:
-                        # on first hit
-                        # make assignment
-                        self.assign_request(request_id, t)
-                        hit = 1
-                        pairs +=1
-                        break
-                if not hit:
-                    self.requests_pending_deque_temporary.append(request_id)
+                possible_taxi_ids = set(city.find_nearest_available_taxis(
+                    [requests.ox[request_id], requests.oy[request_id]],
+                    mode="circle",
+                    radius=city.hard_limit,
+                    index=index
+                ))
+                # poorest taxi among the near ones
+                taxi_id = next((t for t in ta_list if t in possible_taxi_ids), None)
+                if taxi_id is not None:
+                    # make assignment
+                    self.assign_request(request_id, taxi_id)
+                else:
+                    still_pending.append(request_id)
 
         else:
             print("I know of no such assignment mode! Please provide a valid one!")
@@ -695,26 +933,17 @@ class Simulation:
         request_id : int
         """
 
-        # mark pickup timestamp
-        r = self.requests[request_id]
-        t = self.taxis[r.taxi_id]
-
-        self.taxis_to_request.remove(r.taxi_id)
-        self.taxis_to_destination.add(r.taxi_id)
+        taxi_id = int(self.requests.taxi_id[request_id])
 
         # change taxi state to with passenger
-        t.to_request = False
-        t.with_passenger = True
-        t.available = False
-
-        r.timestamps['pickup'] = self.time
-        r.mode = 'serving'
+        self.taxis_to_request.remove(taxi_id)
+        self.taxis_to_destination.add(taxi_id)
 
-        # update request and taxi instances
-        self.requests[request_id] = r
-        self.taxis[r.taxi_id] = t
+        # mark pickup timestamp
+        self.requests.pickup_ts[request_id] = self.time
+        self.requests.mode[request_id] = 'serving'
         if self.log:
-            print('\tP ' + "request " + str(request_id) + ' taxi ' + str(t.taxi_id))
+            print('\tP ' + "request " + str(request_id) + ' taxi ' + str(taxi_id))
 
     def dropoff_request(self, request_id, mode="simple"):
         """
@@ -722,73 +951,102 @@ class Simulation:
         
         """
 
-        r = self.requests[request_id]
-        t = self.taxis[r.taxi_id]
+        taxi_id = int(self.requests.taxi_id[request_id])
 
         if mode == "simple" or mode == "going_home":
             # mark request as done
-            r.timestamps['dropoff'] = self.time
-            r.mode = 'done'
+            self.requests.dropoff_ts[request_id] = self.time
+            self.requests.mode[request_id] = 'done'
             self.requests_in_progress.remove(request_id)
-            t.requests_completed.add(request_id)
             # remove taxi from to_destination list
-            self.taxis_to_destination.remove(r.taxi_id)
+            self.taxis_to_destination.remove(taxi_id)
         elif mode == "cancel":
             # mark request as dropped
-            r.mode = 'dropped'
+            self.requests.mode[request_id] = 'dropped'
             # remove request from progressing ones
             self.requests_in_progress.remove(request_id)
             # clear taxi path
-            t.next_destination = deque()
+            self.path_head[taxi_id] = self.path_tail[taxi_id] = 0
             # remove taxi from to_request list
-            self.taxis_to_request.remove(r.taxi_id)
+            self.taxis_to_request.remove(taxi_id)
+            # the fixed price of the request is lost
+            self.taxi_income[taxi_id] -= self.price_fixed
 
         # update taxi lists
         if mode=="going_home":
             # (magic wand) Apparate taxi home!
-            t.x,t.y = t.home
+            self.city.taxi_x[taxi_id], self.city.taxi_y[taxi_id] = self.taxi_home[taxi_id]
 
         # update global availability containers
-        self.taxis_available[r.taxi_id] = t
-        self.city.A[self.city.coordinate_dict_ij_to_c[t.x][t.y]].add(r.taxi_id)
+        self.taxis_available.add(taxi_id)
+        self.city.taxi_available[taxi_id] = True
 
         # update taxi internal states
-        t.with_passenger = False
-        t.available = True
-        t.actual_request_executing = None
-
-        # update request and taxi instances in global containers
-        self.requests[request_id] = r
-        self.taxis[r.taxi_id] = t
+        self.taxi_request[taxi_id] = -1
 
         if self.log:
-            print("\tD request " + str(request_id) + ' taxi ' + str(t.taxi_id))
+            print("\tD request " + str(request_id) + ' taxi ' + str(taxi_id))
 
-    def eval_taxi_income(self, taxi_id):
+    def eval_taxi_income(self, taxi_id=None):
         """
 
         Parameters
         ----------
-        taxi_id : int
-            select taxi from self.taxis with id
+        taxi_id : int or np.array of ints, optional
+            select taxi from self.taxis with id, all taxis if not given
 
         Returns
         -------
-        price : int
+        price : int/float or np.array of ints/floats, integers if all prices and costs are integers
             evaulated earnnigs of the taxi based on config
 
+            number_of_requests_completed * price_fixed +
+            int(not available) * price_fixed +
+            time_serving * price_per_dist -
+            (time_cruising + time_serving + time_to_request) * cost_per_unit -
+            (time_serving + time_cruising + time_to_request + time_waiting) * cost_per_time
+
+            where the times are read from the row of the taxi in self.taxi_times
+
+            this is kept up to date in self.taxi_income whenever one of the terms changes
+
         """
 
-        t = self.taxis[taxi_id]
+        if taxi_id is None:
+            return self.taxi_income.copy()
+        return self.taxi_income[taxi_id]
+
+    def init_artists(self):
+        """
+        Create the plot elements of the map once, plot_simulation only updates their data.
 
-        price =\
-            len(t.requests_completed) * self.price_fixed +\
-            int(not t.available) * self.price_fixed +\
-            t.time_serving*self.price_per_dist -\
-            (t.time_cruising+t.time_serving+t.time_to_request)*self.cost_per_unit -\
-            (t.time_serving+t.time_cruising+t.time_to_request+t.time_waiting)*self.cost_per_time
+        """
+        # circles, paths and destination stars of all taxis, each drawn as one collection
+        self._taxi_artist = self.canvas_ax.scatter([], [], s=100, marker='o', zorder=2)
+        self._path_artist = LineCollection([], zorder=2)
+        self.canvas_ax.add_collection(self._path_artist)
+        self._star_artist = self.canvas_ax.scatter([], [], s=25, marker='*', zorder=2)
+
+        if self.show_map_labels:
+            self._taxi_labels = [
+                self.canvas_ax.annotate(str(taxi_id), xy=(0, 0), ha='center', va='center', color='white')
+                for taxi_id in range(len(self.taxis))
+            ]
+
+        # origins of requests that are being served
+        self._request_artist, = self.canvas_ax.plot([], [], 'ro', ms=3)
+        self._request_labels = []
+
+        # taxi base
+        self.canvas_ax.plot(
+            self.city.base_coords[0],
+            self.city.base_coords[1],
+            'ks',
+            ms=15
+        )
 
-        return price
+        # pending requests
+        self._pending_artist, = self.canvas_ax.plot([], [], 'ro', ms=3, alpha=0.5)
 
     def plot_simulation(self):
         """
@@ -796,128 +1054,76 @@ class Simulation:
         
         Is based on the taxis and requests and their internal states.
         """
-
-        self.init_canvas()
-
-        for taxi_id, i in self.taxis.keys.items():
-            t = self.taxis[taxi_id]
-
-            # plot a circle at the place of the taxi
-            self.canvas_ax.plot(t.x, t.y, 'o', ms=10, c=self.cmap(self.taxi_colors[i]))
-
-            if self.show_map_labels:
+        num_taxis = len(self.taxis)
+        taxi_xy = np.column_stack([self.city.taxi_x[:num_taxis], self.city.taxi_y[:num_taxis]])
+
+        # a circle at the place of each taxi
+        self._taxi_artist.set_offsets(taxi_xy)
+        self._taxi_artist.set_color(self._rgba)
+        if self.show_map_labels:
+            for label, xy in zip(self._taxi_labels, taxi_xy.tolist()):
+                label.xy = xy
+                label.set_position(xy)
+
+        # taxis with a path ahead of them, their paths with a star at their destinations
+        moving = np.flatnonzero(self.path_tail > self.path_head)
+        self._path_artist.set_segments([
+            np.vstack([taxi_xy[taxi_id], self.paths[taxi_id, self.path_head[taxi_id]:self.path_tail[taxi_id]]])
+            for taxi_id in moving.tolist()
+        ])
+        self._path_artist.set_color(self._rgba[moving])
+        self._star_artist.set_offsets(self.paths[moving, self.path_tail[moving] - 1])
+        self._star_artist.set_color(self._rgba[moving])
+
+        # requests that are waiting for their assigned taxi
+        request_ids = self.taxi_request[np.fromiter(self.taxis_to_request, dtype=np.int64, count=len(self.taxis_to_request))]
+        self._request_artist.set_data(self.requests.ox[request_ids], self.requests.oy[request_ids])
+        if self.show_map_labels:
+            for label in self._request_labels:
+                label.remove()
+            self._request_labels = [
                 self.canvas_ax.annotate(
-                    str(i),
-                    xy=(t.x, t.y),
-                    xytext=(t.x, t.y),
+                    request_id,
+                    xy=(self.requests.ox[request_id], self.requests.oy[request_id]),
+                    xytext=(self.requests.ox[request_id] - 0.2, self.requests.oy[request_id] - 0.2),
                     ha='center',
-                    va='center',
-                    color='white'
+                    va='center'
                 )
-
-            # if the taxi has a path ahead of it, plot it
-            if len(t.next_destination)> 0:
-                path = np.array([[t.x, t.y]] + list(t.next_destination))
-                if len(path) > 1:
-                    xp, yp = path.T
-                    # plot path
-                    self.canvas_ax.plot(
-                        xp,
-                        yp,
-                        '-',
-                        c=self.cmap(self.taxi_colors[i])
-                    )
-                    # plot a star at taxi destination
-                    self.canvas_ax.plot(
-                        path[-1][0],
-                        path[-1][1],
-                        '*',
-                        ms=5,
-                        c=self.cmap(self.taxi_colors[i])
-                    )
-
-            # if a taxi serves a request, put request on the map
-            request_id = t.actual_request_executing
-            if (request_id is not None) and (not t.with_passenger):
-                r = self.requests[request_id]
-                self.canvas_ax.plot(
-                    r.ox,
-                    r.oy,
-                    'ro',
-                    ms=3
-                )
-                if self.show_map_labels:
-                    self.canvas_ax.annotate(
-                        request_id,
-                        xy=(r.ox, r.oy),
-                        xytext=(r.ox - 0.2, r.oy - 0.2),
-                        ha='center',
-                        va='center'
-                    )
-
-        # plot taxi base
-        self.canvas_ax.plot(
-            self.city.base_coords[0],
-            self.city.base_coords[1],
-            'ks',
-            ms=15
-        )
+                for request_id in request_ids.tolist()
+            ]
 
         # plot pending requests
         if self.show_pending:
-            for request_id in self.requests_pending_deque:
-                self.canvas_ax.plot(
-                    self.requests[request_id].ox,
-                    self.requests[request_id].oy,
-                    'ro',
-                    ms=3,
-                    alpha=0.5
-                )
+            rp_list = np.fromiter(self.requests_pending_deque, dtype=np.int64, count=len(self.requests_pending_deque))
+            self._pending_artist.set_data(self.requests.ox[rp_list], self.requests.oy[rp_list])
 
         self.canvas.show()
 
     def move_taxi(self, taxi_id):
         """
-        Move a taxi one step forward according to its path queue.
-        
-        Update taxi position on availablity grid, if necessary.
+        Update the state of a taxi that has been moved one step forward
+        according to its path by _advance_taxis.
+
+        Taxis that stand still are accounted for in step_time.
         
         Parameters
         ----------
-        plt.ion()
         taxi_id : int
             unique id of taxi that we want to move
         """
-        t = self.taxis[taxi_id]
-
-        try:
-            # move taxi one step forward    
-            move = t.next_destination.popleft()
-
-            old_x = t.x
-            old_y = t.y
-
-            t.x = move[0]
-            t.y = move[1]
-
-            if t.with_passenger:
-                t.time_serving += 1
+        if taxi_id in self.taxis_to_destination:
+            self.taxi_times[taxi_id, TIME_SERVING] += 1
+            self.taxi_income[taxi_id] += self.price_per_dist - self.cost_per_unit - self.cost_per_time
+        else:
+            if self.city.taxi_available[taxi_id]:
+                self.taxi_times[taxi_id, TIME_CRUISING] += 1
             else:
-                if t.available:
-                    t.time_cruising += 1
-                else:
-                    t.time_to_request += 1
-
-            # move available taxis on availability grid
-            if t.available:
-                self.city.A[self.city.coordinate_dict_ij_to_c[old_x][old_y]].remove(taxi_id)
-                self.city.A[self.city.coordinate_dict_ij_to_c[t.x][t.y]].add(taxi_id)
-            if self.log:
-                print("\tF moved taxi " + str(taxi_id) + " remaining path ", list(t.next_destination), "\n", end="")
-        except:
-            t.time_waiting += 1
+                self.taxi_times[taxi_id, TIME_TO_REQUEST] += 1
+            self.taxi_income[taxi_id] -= self.cost_per_unit + self.cost_per_time
 
-        self.taxis[taxi_id] = t
+        if self.log:
+            print("\tF moved taxi " + str(taxi_id) + " remaining path ",
+                  self.paths[taxi_id, self.path_head[taxi_id]:self.path_tail[taxi_id]].tolist(), "\n", end="")
 
     def run_batch(self, run_id, data_path='results'):
         """
@@ -949,6 +1155,9 @@ class Simulation:
 
         results = []
 
+        # per taxi metrics are dumped after every batch into a file that stays open during the run
+        ptm_file = open(data_path + '/run_' + run_id + '_per_taxi_metrics.json', 'w')
+
         time1 = time()
         for i in range(self.num_iter):
             # tick the clock
@@ -958,26 +1167,20 @@ class Simulation:
             ptm = measurement.read_per_taxi_metrics()
 
             if i == 0:
-                # clearing future output files
-                f = open(data_path + '/run_' + run_id + '_per_taxi_metrics.json', 'w')
-                f.close()
-                f = open(data_path + '/run_' + run_id + '_per_request_metrics.json', 'w')
-                f.close()
-
                 # adding taxi homes to output
-                ptm['taxi_homes'] = [[int(self.taxis[t].home[0]), int(self.taxis[t].home[1])] for t in self.taxis]
+                ptm['taxi_homes'] = self.taxi_home.tolist()
 
             # dumping per taxi metrics out (per batch)
-            f = open(data_path + '/run_' + run_id + '_per_taxi_metrics.json', 'a')
-            json.dump(ptm, f)
-            f.write('\n')
-            f.close()
+            json.dump(ptm, ptm_file)
+            ptm_file.write('\n')
             results.append(measurement.read_aggregated_metrics(ptm))
             time2 = time()
             print('Simulation batch '+str(i+1)+'/'+str(self.num_iter)+' , %.2f sec/batch.' % (time2-time1))
 
             time1 = time2
 
+        ptm_file.close()
+
         # dumping batch results
         f = open(data_path + '/run_' + run_id + '_aggregates.csv', 'w')
         pd.DataFrame.from_dict(results).to_csv(f, float_format="%.4f")
@@ -985,10 +1188,14 @@ class Simulation:
         f.close()
 
         # dumping per request metrics out (only at the end)
-        f = open(data_path + '/run_' + run_id + '_per_request_metrics.json', 'a')
+        f = open(data_path + '/run_' + run_id + '_per_request_metrics.json', 'wb')
         prm = measurement.read_per_request_metrics()
-        json.dump(prm, f)
-        f.write('\n')
+        if orjson is not None:
+            # per request metrics hold no NaN values, which orjson would write as null
+            f.write(orjson.dumps(prm))
+        else:
+            f.write(json.dumps(prm).encode())
+        f.write(b'\n')
         f.close()
 
         # compressing written objects
@@ -1016,18 +1223,13 @@ class Simulation:
             print("\t To destination: " + str(len(self.taxis_to_destination)))
             print("\n")
             req_counter = {'TOTAL':self.latest_request_id}
-            for request_id in self.requests:
-                r = self.requests[request_id]
-                if r.mode in req_counter:
-                    req_counter[r.mode] += 1
-                else:
-                    req_counter[r.mode] = 1
+            modes, counts = np.unique(self.requests.mode[:len(self.requests)], return_counts=True)
+            req_counter.update(zip(modes.tolist(), counts.tolist()))
             print('Requests:')
             for mode in req_counter:
                 print('\t'+mode+': '+str(req_counter[mode]))
             print("\n")
             print("Requests pending: ")
-            print(self.requests_pending)
             print(self.requests_pending_deque)
             print(self.requests_pending_deque_temporary)
 
@@ -1036,30 +1238,36 @@ class Simulation:
             self.go_home_everybody()
         else:
             # move every taxi one step towards its destination
-            for taxi_id in self.taxis:
-                self.move_taxi(taxi_id)
+            moved = _advance_taxis(self.city.taxi_x, self.city.taxi_y, self.paths, self.path_head, self.path_tail)
+
+            # taxis standing still are waiting
+            self.taxi_times[~moved, TIME_WAITING] += 1
+            self.taxi_income[~moved] -= self.cost_per_time
 
-                t = self.taxis[taxi_id]
+            # only taxis that moved or carry out a request can change state
+            taxi_ids = np.flatnonzero(moved).tolist()
+            taxi_ids = sorted(self.taxis_to_request.union(self.taxis_to_destination, taxi_ids))
+
+            for taxi_id in taxi_ids:
+                if moved[taxi_id]:
+                    self.move_taxi(taxi_id)
+                x, y = self.city.taxi_x[taxi_id], self.city.taxi_y[taxi_id]
 
                 # if a taxi can pick up its passenger, do it
                 if taxi_id in self.taxis_to_request:
-                    r = self.requests[t.actual_request_executing]
-                    if (t.x == r.ox) and (t.y == r.oy):
-                        try:
-                            self.pickup_request(t.actual_request_executing)
-                        except KeyError:
-                            print(t)
-                            print(r)
+                    request_id = int(self.taxi_request[taxi_id])
+                    if (x == self.requests.ox[request_id]) and (y == self.requests.oy[request_id]):
+                        self.pickup_request(request_id)
                 # if a taxi can drop off its passenger, do it
                 elif taxi_id in self.taxis_to_destination:
-                    r = self.requests[t.actual_request_executing]
-                    if (t.x == r.dx) and (t.y == r.dy):
-                        self.dropoff_request(r.request_id)
+                    request_id = int(self.taxi_request[taxi_id])
+                    if (x == self.requests.dx[request_id]) and (y == self.requests.dy[request_id]):
+                        self.dropoff_request(request_id)
                         if self.behaviour == "go_back":
                             if self.initial_conditions == "base":
                                 self.go_to_base(taxi_id, self.city.base_coords)
                             elif self.initial_conditions == "home":
-                                self.go_to_base(taxi_id, t.home)
+                                self.go_to_base(taxi_id, self.taxi_home[taxi_id])
                         elif self.behaviour == "stay":
                             pass
                         elif self.behaviour == "cruise":
@@ -1072,31 +1280,24 @@ class Simulation:
         self.requests_pending_deque.extendleft(self.requests_pending_deque_temporary)
         self.requests_pending_deque_temporary = deque()
         # delete old requests from pending ones
-        if self.time > self.max_request_waiting_time and len(self.requests_pending_deque) > 0:
-            while len(self.requests_pending_deque)>0 and (self.requests_pending_deque[0] in self.requests_pending_deque_batch[0]):
-                request_id = self.requests_pending_deque.popleft()
-                self.requests[request_id].mode = 'dropped'
-
-        self.requests_pending = set(self.requests_pending_deque)
+        # the deque is ordered by timestamps, so the old ones are at its beginning
+        while len(self.requests_pending_deque) > 0 and \
+                self.requests.request_ts[self.requests_pending_deque[0]] <= \
+                self.time - self.max_request_waiting_time:
+            request_id = self.requests_pending_deque.popleft()
+            self.requests.mode[request_id] = 'dropped'
 
         # generate requests
-        new_requests = set()
         rfrac, rint = np.modf(self.request_rate)
-        for i in range(int(rint)):
-            self.add_request()
-            new_requests.add(self.latest_request_id)
+        self.add_request(int(rint))
         if rfrac > 1e-3:
             try:
                 p = self.city.request_p.pop()
             except IndexError:
-                self.city.request_p.extend(np.random.random(self.city.length))
+                self.city.request_p.extend(self._rng.random(self.city.length))
                 p = self.city.request_p.pop()
             if p < rfrac:
                 self.add_request()
-                new_requests.add(self.latest_request_id)
-
-        # this automatically pushes out requests that have been waiting for too long
-        self.requests_pending_deque_batch.append(new_requests)
 
         if self.show_plot:
             self.plot_simulation()
@@ -1151,49 +1352,39 @@ class Measurements:
         """
 
         # for the taxis
+        simulation = self.simulation
+        requests = simulation.requests
+        num_taxis = len(simulation.taxis)
+
+        # lengths of completed trips, grouped by the serving taxi
+        done = requests.mode[:len(requests)] == 'done'
+        trip_taxi_ids = requests.taxi_id[:len(requests)][done]
+        lengths = (
+            np.abs(requests.dy[:len(requests)][done] - requests.oy[:len(requests)][done]) +
+            np.abs(requests.dx[:len(requests)][done] - requests.ox[:len(requests)][done])
+        ).astype(float)
+
+        # number of trips, average trip lengths and their standard deviations per taxi
+        counts = np.bincount(trip_taxi_ids, minlength=num_taxis)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.bincount(trip_taxi_ids, weights=lengths, minlength=num_taxis) / counts
+            deviation = lengths - mean[trip_taxi_ids]
+            std = np.sqrt(np.bincount(trip_taxi_ids, weights=deviation**2, minlength=num_taxis) / counts)
+
+        trip_num_completed = counts.tolist()
+        # taxis without trips report an average of 0 and a deviation of nan
+        trip_avg_length = [
+            avg if n > 0 else 0 for avg, n in zip(np.round(mean, 4).tolist(), trip_num_completed)
+        ]
+        trip_std_length = np.round(std, 4).tolist()
+        incomes = simulation.eval_taxi_income().tolist()
 
-        # average trip lengths per taxi
-        trip_avg_length = []
-        trip_std_length = []
-        incomes = []
-        trip_num_completed = []
-        
-        time_serving = []
-        time_to_request = []
-        time_cruising = []
-        time_waiting = []
-        
-        position = []
-
-        for taxi_id in self.simulation.taxis:
-            taxi = self.simulation.taxis[taxi_id]
-            req_lengths = []
-
-            for request_id in taxi.requests_completed:
-                r = self.simulation.requests[request_id]
-                length = float(np.abs(r.dy - r.oy) + np.abs(r.dx - r.ox))
-                req_lengths.append(length)
+        time_serving = simulation.taxi_times[:, TIME_SERVING].tolist()
+        time_to_request = simulation.taxi_times[:, TIME_TO_REQUEST].tolist()
+        time_cruising = simulation.taxi_times[:, TIME_CRUISING].tolist()
+        time_waiting = simulation.taxi_times[:, TIME_WAITING].tolist()
 
-            if len(req_lengths) > 0:
-                trip_avg_length.append( round(np.nanmean(req_lengths), 4) )
-                trip_std_length.append( round(np.nanstd(req_lengths), 4) )
-            else:
-                trip_avg_length.append(0)
-                trip_std_length.append(np.nan)
-            trip_num_completed.append(len(req_lengths))
-            incomes.append(self.simulation.eval_taxi_income(taxi_id))
-
-            s = taxi.time_serving
-            w = taxi.time_waiting
-            r = taxi.time_to_request
-            c = taxi.time_cruising
-            
-            time_serving.append(s)
-            time_cruising.append(c)
-            time_waiting.append(w)
-            time_to_request.append(r)
-
-            position.append([int(taxi.x), int(taxi.y)])
+        position = np.column_stack([simulation.city.taxi_x, simulation.city.taxi_y])[:num_taxis].tolist()
 
         return {
             "timestamp": self.simulation.time,
@@ -1222,24 +1413,41 @@ class Measurements:
         """
 
         # for the requests
+        requests = self.simulation.requests
+        num_requests = len(requests)
+
+        def timestamps(ts):
+            # timestamps of events that have not happened yet are reported as None
+            ts = ts[:num_requests].astype(object)
+            ts[ts == -1] = None
+            return ts.tolist()
+
+        columns = zip(
+            range(num_requests),
+            np.column_stack([requests.ox[:num_requests], requests.oy[:num_requests]]).tolist(),
+            np.column_stack([requests.dx[:num_requests], requests.dy[:num_requests]]).tolist(),
+            timestamps(requests.request_ts),
+            timestamps(requests.assigned_ts),
+            timestamps(requests.pickup_ts),
+            timestamps(requests.dropoff_ts)
+        )
 
         output_dict = {
             "timestamp": self.simulation.time,
-            "requests": []
+            "requests": [
+                {
+                    "request_id": request_id,
+                    "origin": origin,
+                    "destination": destination,
+                    "timestamp": request_ts,
+                    "assignment": assigned_ts,
+                    "pickup": pickup_ts,
+                    "dropoff": dropoff_ts
+                }
+                for request_id, origin, destination, request_ts, assigned_ts, pickup_ts, dropoff_ts in columns
+            ]
         }
 
-        for request_id in self.simulation.requests:
-            r = self.simulation.requests[request_id]
-            output_dict["requests"].append({
-                "request_id": r.request_id,
-                "origin" : (r.ox, r.oy),
-                "destination": (r.dx, r.dy),
-                "timestamp": r.timestamps["request"],
-                "assignment": r.timestamps["assigned"],
-                "pickup": r.timestamps["pickup"],
-                "dropoff": r.timestamps["dropoff"]
-            })
-
         return output_dict
 
     @staticmethod
@@ -1248,12 +1456,12 @@ class Measurements:
         metrics = {"timestamp": per_taxi_metrics["timestamp"]}
 
         for k in per_taxi_metrics:
-            if k[0:6] == 'trip_i':
-                metrics['avg_'+k] = np.nanmean(per_taxi_metrics[k])
-                metrics['std_' + k] = np.nanstd(per_taxi_metrics[k])
-            elif k[0:4] == 'time':
-                metrics['avg_' + k] = np.nanmean(per_taxi_metrics[k])
-                metrics['std_' + k] = np.nanstd(per_taxi_metrics[k])
+            if k[0:6] == 'trip_i' or k[0:4] == 'time':
+                # each list is converted once, the deviations reuse the mean
+                values = np.asarray(per_taxi_metrics[k], dtype=np.float64)
+                mean = np.nanmean(values)
+                metrics['avg_' + k] = mean
+                metrics['std_' + k] = np.sqrt(np.nanmean((values - mean) ** 2))
 
         return metrics
     
\ No newline at end of file
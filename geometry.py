@@ -1,11 +1,55 @@
 
 import numpy as np
-from random import shuffle
 
 # special data types
 from collections import deque
 from scipy.interpolate import interp1d
 
+try:
+    # compiling numerical loops, if numba is installed
+    from numba import njit, prange
+except ImportError:
+    def njit(*args, **kwargs):
+        # without numba, decorated functions run as plain Python
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+    prange = range
+
+
+@njit(inline='always')
+def _manhattan(ax, ay, bx, by):
+    # grid distance of two points, see City.measure_distance
+    return abs(ax - bx) + abs(ay - by)
+
+
+@njit(cache=True)
+def _taxis_within(ids, taxi_x, taxi_y, taxi_available, sx, sy, radius, nearest):
+    """
+    Select the available taxis among ids that are closer to (sx, sy) than radius.
+
+    If nearest is set, only the taxis at the smallest distance are kept.
+    The selected taxi_ids are returned in increasing order.
+    """
+    found = np.empty(len(ids), dtype=ids.dtype)
+    dist = np.empty(len(ids), dtype=np.int64)
+    k = 0
+    best = radius
+
+    for j in range(len(ids)):
+        t = ids[j]
+        if taxi_available[t]:
+            d = _manhattan(taxi_x[t], taxi_y[t], sx, sy)
+            if d < radius:
+                found[k] = t
+                dist[k] = d
+                k += 1
+                best = min(best, d)
+
+    if nearest:
+        return np.sort(found[:k][dist[:k] == best])
+    return np.sort(found[:k])
+
 
 class City:
     """
@@ -38,13 +82,16 @@ class City:
                     x and y define the shape of the desired density function that we rotate around the center
                     strength is the mixture weight f
 
+        num_taxis : int, optional
+            expected number of taxis, used to preallocate taxi position storage
+
         Attributes
         ----------
-        A : np.array of lists
-            placeholder to store list of available taxi_ids at their actual positions
+        taxi_x, taxi_y : np.array of ints
+            grid coordinates of the taxis, indexed by taxi_id
 
-        N : np.array of sets
-            stores grid neighborhoods for faster access
+        taxi_available : np.array of bools
+            flags that store whether a taxi is available, indexed by taxi_id
 
         n : int
             width of grid
@@ -54,8 +101,14 @@ class City:
 
         length : int
             length of coordstacks that speed up random origin and destination generation
+
+        _rng : np.random.Generator
+            source of all random numbers of the city, seeded by config["seed"] if present
         """
 
+        # random number generator, reproducible runs if a seed is given
+        self._rng = np.random.default_rng(config.get("seed"))
+
         # grid dimensions
         self.n = config["n"]  # number of pixels in x direction
         self.m = config["m"]  # number of pixels in y direction
@@ -65,14 +118,14 @@ class City:
         else:
             self.base_coords = [int(self.n/2), int(self.m/2)]
 
-        # list that stores taxi_id of available taxis at the
-        # specific position on the grid
-        # we initialize this array with empty sets
-        # it can be a list because of the continuous indexing scheme
-        self.A = [set() for _ in range(self.n*self.m)]
-
-        # storing neighbors in a dict for fast access
-        self.N = {c: self.neighbors(c) for c in range(self.n*self.m)}
+        # taxi positions and availability are stored in flat arrays indexed by taxi_id
+        if "num_taxis" in config:
+            capacity = config["num_taxis"]
+        else:
+            capacity = 0
+        self.taxi_x = np.zeros(capacity, dtype=np.int32)
+        self.taxi_y = np.zeros(capacity, dtype=np.int32)
+        self.taxi_available = np.zeros(capacity, dtype=bool)
 
         # generating stacks for request coordinate choice
 
@@ -128,25 +181,6 @@ class City:
         else:
             self.length = config["length"]
 
-        # pre-storing coordinates
-        # dicts for converting between real positions and their labels
-        self.coordinate_dict_ij_to_c = {}
-        for i in range(self.m):
-            for j in range(self.n):
-                if i in self.coordinate_dict_ij_to_c:
-                    self.coordinate_dict_ij_to_c[i][j]=self.ij_to_c(i,j)
-                else:
-                    self.coordinate_dict_ij_to_c[i] = {j : self.ij_to_c(i,j)}
-
-        self.coordinate_dict_c_to_ij = {}
-        for c in range(self.n*self.m):
-            self.coordinate_dict_c_to_ij[c] = self.c_to_ij(c)
-
-        # pre-storing BFS-trees until the depth self.hard_limit
-        self.bfs_trees = {}
-        for c in range(self.n*self.m):
-            self.bfs_trees[c] = self.create_BFS_tree(c)
-
         # pre-storing inverse CDFs for arbitrary distributions
         for d in self.request_origin_distributions:
             if "x" in d:
@@ -179,7 +213,7 @@ class City:
             try:
                 p = self.request_p.pop()
             except IndexError:
-                self.request_p.extend(np.random.random(self.length))
+                self.request_p.extend(self._rng.random(self.length))
                 p = self.request_p.pop()
             ind = np.digitize(p, self.request_origin_probabilities)
         else:
@@ -199,7 +233,7 @@ class City:
             try:
                 p = self.request_p.pop()
             except IndexError:
-                self.request_p.extend(np.random.random(self.length))
+                self.request_p.extend(self._rng.random(self.length))
                 p = self.request_p.pop()
             ind = np.digitize(p, self.request_destination_probabilities)
         else:
@@ -215,6 +249,22 @@ class City:
 
         return ox, oy, dx, dy
 
+    def create_request_coords(self, count):
+        """
+        Origin and destination coordinates for several requests at once.
+
+        The random numbers are drawn in bulk into the coordstacks, so this only
+        pops the pregenerated coordinates for each request.
+
+        Returns
+        -------
+
+        np.array of ints
+            one row of ox, oy, dx, dy per request
+        """
+        coords = [self.create_one_request_coord() for _ in range(count)]
+        return np.array(coords, dtype=np.int32).reshape(count, 4)
+
     @staticmethod
     def measure_distance(source, destination):
         """
@@ -229,10 +279,9 @@ class City:
         $$|x_s-x_d|+|y_s-y_d|$$
         """
 
-        return np.dot(np.abs(np.array(destination) - np.array(source)), [1, 1])
+        return abs(int(destination[0]) - int(source[0])) + abs(int(destination[1]) - int(source[1]))
 
-    @staticmethod
-    def create_path(source, destination):
+    def create_path(self, source, destination, out=None):
         """
         Choose a random shortest path between source and destination.
 
@@ -245,105 +294,101 @@ class City:
         destination : [int,int]
             grid coordinates of the destination
 
+        out : np.array of ints, optional
+            buffer with at least as many rows as the path, the path is written into its first rows
+
 
         Returns
         -------
 
-        path : list of coordinate tuples
-            coordinate list of a random path between source and destinaton
+        path : np.array of ints
+            coordinates of a random path between source and destinaton, one row per step,
+            the source is included in the first row, a view of out if it is given
 
         """
 
         # distance along the x and the y axis
-        d = dict(zip(['x', 'y'], np.array(destination) - np.array(source)))
+        dx = destination[0] - source[0]
+        dy = destination[1] - source[1]
 
-        # create a sequence of "x"-es and "y"-s
+        # create a sequence of unit steps in the x and the y direction
         # we are going to shuffle this sequence
         # to get a random order of "x" and "y" direction steps
-        sequence = ['x'] * int(np.abs(d['x'])) + ['y'] * int(np.abs(d['y']))
-        shuffle(sequence)
+        steps = np.zeros((abs(dx) + abs(dy), 2), dtype=np.int32)
+        steps[:abs(dx), 0] = np.sign(dx)
+        steps[abs(dx):, 1] = np.sign(dy)
+        steps = steps[self._rng.permutation(len(steps))]
 
         # source is included in the path
-        path = [source]
-        for item in sequence:
-            # we add one step in the right direction based on the last position
-            path.append([
-                np.sign(d[item]) * int(item == "x") + path[-1][0],
-                np.sign(d[item]) * int(item == "y") + path[-1][1]
-            ])
+        # every position is the source plus the sum of the steps taken so far
+        if out is None:
+            path = np.empty((len(steps) + 1, 2), dtype=np.int32)
+        else:
+            path = out[:len(steps) + 1]
+        path[0] = source
+        np.cumsum(steps, axis=0, out=path[1:])
+        path[1:] += path[0]
 
         return path
 
-    def neighbors(self, c):
+    #@profile
+    def generate_coords(self, **distr_spec):
         """
-        Calculate the neighbors of a coordinate.
-        On the edges of the simulation grid, there are no neighbors.
-        (E.g. there are only 2 neighbors in the corners.)
 
         Parameters
         ----------
-
-        c : [int,int]
-            input grid coordinate
+        distr_spec: dict that specifies the distribution
 
         Returns
         -------
 
-        ns : list of coordinate tuples
-            list containing the coordinates of the neighbors
-        """
-
-        coordinates = self.c_to_ij(c)
+        list of coordinate pairs chosen from the given distribution, falling between the n*m coordinates
 
-        ns = [(coordinates[0] + dx, coordinates[1] + dy) for dx, dy in [(1, 0), (0, 1), (-1, 0), (0, -1)]]
-        ns = filter(lambda n: (0 <= n[0]) and (self.n > n[0]) and (0 <= n[1]) and (self.m > n[1]), ns)
+        """
+        if "sigma" in distr_spec:
+            # whole batch of samples from the 2D Gaussian, relative to its location
+            coords = self._rng.normal(size=(self.length, 2)) * distr_spec["sigma"]
+        else:
+            u = self._rng.uniform(size=(self.length,))
+            u = u[(distr_spec["interp_min"] < u) & (distr_spec["interp_max"] > u)]
+            phi = 2 * np.pi * self._rng.uniform(size=np.size(u))
+            # the interpolated inverse CDF is evaluated once for both coordinates
+            radius = distr_spec["cdf_inv"](u)
+            coords = np.column_stack([radius * np.cos(phi), radius * np.sin(phi)])
 
-        return [self.ij_to_c(x, y) for x, y in ns]
+        # rounding to grid points and shifting to location
+        coords = np.round(coords).astype(int) + distr_spec["location"]
 
-    def ij_to_c(self, i, j):
-        # grid coordinates to continuous coordinates
-        return self.n*i+j
+        # keeping only the coordinates that fall on the grid
+        inside = (0 <= coords[:, 0]) & (self.n > coords[:, 0]) & (0 <= coords[:, 1]) & (self.m > coords[:, 1])
 
-    def c_to_ij(self, c):
-        # continuous coordinates to grid coordinates
-        return int(c/self.n), c % self.n
+        return coords[inside].tolist()
 
-    #@profile
-    def generate_coords(self, **distr_spec):
+    def add_taxi(self, taxi_id, coords):
         """
+        Put a new available taxi on the grid.
+
+        Storage is doubled if taxi_id does not fit into the preallocated arrays.
 
         Parameters
         ----------
-        distr_spec: dict that specifies the distribution
 
-        Returns
-        -------
-
-        list of coordinate pairs chosen from the given distribution, falling between the n*m coordinates
+        taxi_id : int
+            unique id of the taxi
 
+        coords : [int,int]
+            grid coordinates of the taxi
         """
-        if "sigma" in distr_spec:
-            temp = map(
-                lambda t: (int(round(t[0]*distr_spec["sigma"], 0)+distr_spec["location"][0]),
-                           int(round(t[1]*distr_spec["sigma"], 0))+distr_spec["location"][1]),
-                np.random.normal(size=(self.length, 2))
-            )
-        else:
-            u = np.random.uniform(size=(self.length,))
-            u = u[np.where((distr_spec["interp_min"] < u) & (distr_spec["interp_max"] > u))]
-            phi = 2 * np.pi * np.random.uniform(size=np.size(u))
-            x = distr_spec["cdf_inv"](u) * np.cos(phi)
-            y = distr_spec["cdf_inv"](u) * np.sin(phi)
-
-            temp = map(
-                lambda t: (int(round(t[0], 0)+distr_spec["location"][0]),
-                           int(round(t[1], 0)+distr_spec["location"][1])),
-                zip(x, y)
-            )
-
-        temp = filter(lambda n: (0 <= n[0]) and (self.n > n[0]) and (0 <= n[1]) and (self.m > n[1]), temp)
+        if taxi_id >= len(self.taxi_x):
+            capacity = max(2 * len(self.taxi_x), taxi_id + 1)
+            self.taxi_x = np.resize(self.taxi_x, capacity)
+            self.taxi_y = np.resize(self.taxi_y, capacity)
+            available = np.zeros(capacity, dtype=bool)
+            available[:len(self.taxi_available)] = self.taxi_available
+            self.taxi_available = available
 
-        return temp
+        self.taxi_x[taxi_id], self.taxi_y[taxi_id] = coords
+        self.taxi_available[taxi_id] = True
 
     def create_taxi_home_coords(self):
         """
@@ -357,17 +402,36 @@ class City:
         try:
             hx,hy = self.taxi_home_coordstack.pop()
         except IndexError:
-            temp = list(zip(np.random.randint(0, self.n, 1000), np.random.randint(0, self.m, 1000)))
+            temp = list(zip(self._rng.integers(0, self.n, 1000), self._rng.integers(0, self.m, 1000)))
             self.taxi_home_coordstack.extend(temp)
             hx,hy = self.taxi_home_coordstack.pop()
         return hx,hy
 
+    def index_available_taxis(self):
+        """
+        Sort the available taxis by their x coordinate.
+
+        A lookup in find_nearest_available_taxis then only checks the taxis in the
+        vertical band of the grid that the search radius spans. The index is valid until
+        taxis move, taxis that become unavailable meanwhile are filtered out at lookup.
+
+        Returns
+        -------
+
+        index : (np.array of ints, np.array of ints)
+            taxi_ids ordered by x coordinate, and their x coordinates
+        """
+        ids = np.flatnonzero(self.taxi_available)
+        ids = ids[np.argsort(self.taxi_x[ids], kind="stable")]
+        return ids, self.taxi_x[ids]
+
     #@profile
     def find_nearest_available_taxis(
             self,
             source,
             mode="nearest",
-            radius=None):
+            radius=None,
+            index=None):
         """
         This function lists the available taxis according to mode.
 
@@ -376,8 +440,8 @@ class City:
         Parameters
         ----------
 
-        source : tuple, no default
-            coordinates of the place from which we want to determine the nearest
+        source : [int,int], no default
+            grid coordinates of the place from which we want to determine the nearest
             possible taxi
 
         mode : str, default "nearest"
@@ -389,95 +453,33 @@ class City:
 
         radius : int, optional
             if mode is "circle", gives the circle radius
+
+        index : tuple, optional
+            result of index_available_taxis, reused for several lookups while taxis stand still
         """
         if self.log:
             print("Finding nearest available taxi.")
         if mode == "nearest":
             radius = self.hard_limit
-
-        # select BFS-tree
-        tree = self.bfs_trees[source]
-        # print('This is the BFS-tree.', tree)
-
-        # current depth storage
-        depth = 0
-        # list of available taxis
-
-        p = set()
-
-        while depth < radius:
-            # take the next nodes
-            # print('Taxis available at depth ' + str(depth)+' at nodes '+json.dumps(tree[depth]))
-            ta = set.union(*[self.A[node] for node in tree[depth]])
-            # print(ta)
-            # print(self.A)
-            p = p.union(ta)
-
-            if mode == "nearest" and len(ta)>0:
-                # print("I've found something!")
-                break
-
-            depth += 1
-
-        return list(p)
-
-
-    def create_BFS_tree(
-            self,
-            source,
-            max_depth = None
-    ):
-        """
-
-        Parameters
-        ----------
-        source: [int,int]
-            origin coordinates
-        max_depth: int
-            depth of tree
-
-        Returns
-        -------
-
-        dictionary storing BFS-tree of depth max depths around given source
-
-        """
-
-        if max_depth == None:
-            max_depth = self.hard_limit+1
-
-        # BFS init
-        # queue for BFS visit
-        q = deque()
-        q.append(source)
-        # visited nodes with distance from the source node
-        visited = {source: 0}
-        # current depth storage
-        depth = 0
-
-        # while we still have nodes to visit
-        while len(q) != 0 and depth < max_depth:
-            # take the next node
-            v = q.popleft()
-
-            # visit the neighbors of v
-            for n in self.N[v]:
-                if n not in visited:
-                    q.append(n)
-                    # the depth of the neighbor is one more than that of its parent in the BFS tree
-                    depth = visited[v] + 1
-                    # if we surpass the search radius, quit BFS
-                    if depth > max_depth:
-                        break
-                    # store node in the visited ones
-                    visited[n] = depth
-
-        bfs_tree = {}
-        # reverse dict
-        for k,v in visited.items():
-            if v in bfs_tree:
-                bfs_tree[v].append(k)
-            else:
-                bfs_tree[v] = [k]
-
-        return bfs_tree
\ No newline at end of file
+        if index is None:
+            index = self.index_available_taxis()
+
+        ids, xs = index
+        if len(ids) == 0:
+            # no available taxis anywhere
+            return []
+
+        # only taxis in the band source[0]-radius < x < source[0]+radius can be within the radius
+        lo = np.searchsorted(xs, source[0] - radius, side="right")
+        hi = np.searchsorted(xs, source[0] + radius, side="left")
+
+        return _taxis_within(
+            ids[lo:hi],
+            self.taxi_x,
+            self.taxi_y,
+            self.taxi_available,
+            source[0],
+            source[1],
+            radius,
+            mode == "nearest"
+        ).tolist()